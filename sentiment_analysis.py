@@ -1,20 +1,87 @@
-import openpyxl
-import time
+import asyncio
+import functools
+import hashlib
+import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
+import sys
 import json
+import time
 import traceback
+import diskcache
+import orjson
+import pandas as pd
+from aiolimiter import AsyncLimiter
 from google.api_core.exceptions import ResourceExhausted
 import google.generativeai as genai
 
+try:
+    from google import genai as genai_sdk  # google-genai; only --batch needs it
+except ImportError:
+    genai_sdk = None
+
+try:
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass  # uvloop is optional; fall back to the default event loop
+
 categories = [
     "Cleanliness", "Menu Variety", "Portion Size", "Staff Friendliness", "Overall Experience",
     "Ambiance", "Speed of Service", "Service", "Value for Money", "Food Quality"
 ]
 
+logger = logging.getLogger("sentiment_analysis")
 
-def generate_content_from_file(review):
-    """Generates sentiment and extracts information from a review using Generative AI model."""
-    prompt = f"""You are an expert in analyzing customer reviews for restaurants.  For the following review, please identify the sentiment (positive, negative, or neutral), any staff names mentioned, any dish names mentioned, and the *single most relevant* category from this list: {', '.join(categories)}.  Provide your response in a JSON format with the following structure:
+
+def setup_logging(quiet=False):
+    """Routes log records through a queue to a background listener thread.
+
+    Under asyncio.gather a synchronous print/flush per row becomes a
+    serialization point inside the event loop; with a QueueHandler the
+    formatting and stdout I/O happen off the loop.  Returns the listener so
+    the caller can stop it on shutdown.
+    """
+    log_queue = queue.Queue(-1)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.WARNING if quiet else logging.INFO)
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return listener
+
+MODEL_NAME = 'gemini-2.0-flash'
+
+BATCH_STATE_FILE = ".batch_state.json"
+BATCH_POLL_SECONDS = 30
+
+# Canonical spellings for the sentiment cell; anything unrecognized is Neutral.
+SENT_MAP = {'positive': 'Positive', 'negative': 'Negative', 'neutral': 'Neutral'}
+
+# Output columns appended to each sheet, in order.
+OUTPUT_COLUMNS = {
+    'sentiment': 'Sentiment',
+    'staff': 'Staff Names',
+    'dish': 'Dish Names',
+    'category': 'Category',
+}
+
+# Reviews repeat a lot ("Good", "Nice food", ...), so identical prompts are
+# served from a persistent on-disk cache instead of re-querying Gemini.
+cache = diskcache.Cache(".gemini_cache")
+CACHE_EXPIRE_SECONDS = 30 * 86400
+
+
+def cache_key(review):
+    """Builds the cache key: model name plus normalized review text, hashed."""
+    normalized = str(review).strip().lower()
+    return hashlib.sha256(f"{MODEL_NAME}|{normalized}".encode()).hexdigest()
+
+
+# Built once at import time so the ~700-char literal isn't re-assembled per row.
+PROMPT_PREFIX = f"""You are an expert in analyzing customer reviews for restaurants.  For the following review, please identify the sentiment (positive, negative, or neutral), any staff names mentioned, any dish names mentioned, and the *single most relevant* category from this list: {', '.join(categories)}.  Provide your response in a JSON format with the following structure:
 
 {{
   "sentiment": "positive" or "negative" or "neutral",
@@ -25,160 +92,702 @@ def generate_content_from_file(review):
 
 If a field cannot be determined, set its value to null (for category) or an empty list (for staff_names and dish_names).  Make sure the keys are always enclosed in double quotes.
 
-Here is the review: {review}"""
+Here is the review: """
+
+
+def build_prompt(review):
+    """Builds the analysis prompt for a single review."""
+    return PROMPT_PREFIX + str(review)
+
+
+# Packing budget for multi-review prompts; per-request overhead dominates cost,
+# so tens of reviews share one call instead of one call each.
+MAX_BATCH_INPUT_TOKENS = 6000
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token); good enough for packing."""
+    return len(text) // 4
+
+
+def pack_review_groups(items):
+    """Packs (row_num, review) tuples into groups of ~MAX_BATCH_INPUT_TOKENS input."""
+    groups = []
+    current = []
+    current_tokens = estimate_tokens(PROMPT_PREFIX)
+    for row_num, review in items:
+        review_tokens = estimate_tokens(str(review))
+        if current and current_tokens + review_tokens > MAX_BATCH_INPUT_TOKENS:
+            groups.append(current)
+            current = []
+            current_tokens = estimate_tokens(PROMPT_PREFIX)
+        current.append((row_num, review))
+        current_tokens += review_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def build_batch_prompt(reviews):
+    """Builds one prompt covering several numbered reviews, answered as a JSON array."""
+    numbered = "\n".join(f"{i}. {review}" for i, review in enumerate(reviews, start=1))
+    return f"""You are an expert in analyzing customer reviews for restaurants.  For each of the numbered reviews below, please identify the sentiment (positive, negative, or neutral), any staff names mentioned, any dish names mentioned, and the *single most relevant* category from this list: {', '.join(categories)}.  Provide your response as a JSON array with exactly one object per review, in this structure:
+
+[
+  {{
+    "id": 1,
+    "sentiment": "positive" or "negative" or "neutral",
+    "staff_names": ["list", "of", "staff", "names"] or [],
+    "dish_names": ["list", "of", "dish", "names"] or [],
+    "category": "one of the categories from the list" or null
+  }}
+]
+
+The "id" must match the review's number.  If a field cannot be determined, set its value to null (for category) or an empty list (for staff_names and dish_names).  Make sure the keys are always enclosed in double quotes.
+
+Here are the reviews:
+{numbered}"""
+
+
+# Schemas for Gemini structured output: the model is constrained to emit
+# exactly this JSON, so no fences or prose ever wrap the payload.
+REVIEW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "sentiment": {"type": "string", "enum": ["positive", "negative", "neutral"]},
+        "staff_names": {"type": "array", "items": {"type": "string"}},
+        "dish_names": {"type": "array", "items": {"type": "string"}},
+        "category": {"type": "string", "enum": categories, "nullable": True},
+    },
+    "required": ["sentiment"],
+}
+
+BATCH_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": dict(REVIEW_SCHEMA["properties"], id={"type": "integer"}),
+        "required": ["id", "sentiment"],
+    },
+}
+
+
+# Pull the JSON payload out of a reply that may include prose or code fences.
+JSON_OBJECT_RE = re.compile(r'\{.*\}', re.S)
+JSON_ARRAY_RE = re.compile(r'\[.*\]', re.S)
+
+
+def extract_json(api_response, pattern=JSON_OBJECT_RE):
+    """Extracts and decodes the first JSON object (or array) in a reply.
+
+    Tolerates leading prose and ```json fences without any string surgery;
+    raises orjson.JSONDecodeError when no JSON is present at all.
+    """
+    match = pattern.search(api_response)
+    if match is None:
+        raise orjson.JSONDecodeError("no JSON found in response", api_response, 0)
+    return orjson.loads(match.group(0))
+
+
+def parse_group_response(api_response, expected_count):
+    """Parses a batched JSON-array reply into {id: per-review JSON text}.
+
+    Returns an empty dict when the reply cannot be parsed, so the caller can
+    fall back to single-review prompts.
+    """
+    if not api_response:
+        return {}
+    try:
+        data = extract_json(api_response, JSON_ARRAY_RE)
+    except orjson.JSONDecodeError as e:
+        logger.warning(f"Could not parse batched response ({e}); falling back to single-review prompts")
+        return {}
+    if not isinstance(data, list):
+        logger.warning("Batched response was not a JSON array; falling back to single-review prompts")
+        return {}
+
+    results = {}
+    for entry in data:
+        if not isinstance(entry, dict):
+            continue
+        entry_id = entry.pop('id', None)
+        if isinstance(entry_id, int) and 1 <= entry_id <= expected_count:
+            results[entry_id] = json.dumps(entry)
+    return results
+
+
+@functools.lru_cache(maxsize=1)
+def get_model():
+    """Returns the shared GenerativeModel instance, created lazily on first use.
+
+    Constructing the model per call re-resolves config and auth every time,
+    so a single instance is reused across all reviews.
+    """
+    return genai.GenerativeModel(MODEL_NAME)
+
+
+class AdaptiveRateLimiter:
+    """AIMD pacing for Gemini calls: halve the rate on a 429, recover linearly.
+
+    Proactive pacing beats reactive backoff when several workers share one
+    quota: rather than stalling on 429 storms, the request rate tracks what
+    the API is actually admitting (multiplicative decrease on throttle,
+    additive increase per clean minute).
+    """
+
+    # One multiplicative decrease per window: a storm of concurrent 429s is
+    # one throttle event, not fifteen halvings straight to the floor.
+    DECREASE_WINDOW_SECONDS = 10
+
+    def __init__(self, rpm):
+        self.initial_rpm = rpm
+        self.min_rpm = max(1, rpm // 20)
+        self._limiter = AsyncLimiter(rpm, 60)
+        self._last_adjust = time.monotonic()
+        self._last_decrease = 0.0
+
+    def _set_rate(self, rpm):
+        """Applies a new rate to the underlying bucket.
+
+        aiolimiter derives _rate_per_sec from max_rate only at construction;
+        changing max_rate alone shrinks burst capacity while the bucket keeps
+        draining at the original rate, so both must be updated.
+        """
+        self._limiter.max_rate = rpm
+        self._limiter._rate_per_sec = rpm / self._limiter.time_period
+
+    async def acquire(self):
+        """Waits for a request slot at the current rate."""
+        self._maybe_recover()
+        await self._limiter.acquire()
+
+    def on_throttle(self):
+        """Multiplicative decrease: halves the rate after a 429 (debounced)."""
+        now = time.monotonic()
+        if now - self._last_decrease < self.DECREASE_WINDOW_SECONDS:
+            return
+        self._last_decrease = now
+        self._last_adjust = now
+        new_rate = max(self.min_rpm, self._limiter.max_rate / 2)
+        if new_rate < self._limiter.max_rate:
+            logger.warning(f"Quota pushback; reducing request rate to {new_rate:.0f} rpm")
+            self._set_rate(new_rate)
+
+    def _maybe_recover(self):
+        """Additive increase: claws back a slice of rate per clean minute."""
+        now = time.monotonic()
+        if now - self._last_adjust >= 60 and self._limiter.max_rate < self.initial_rpm:
+            self._set_rate(min(self.initial_rpm,
+                               self._limiter.max_rate + self.initial_rpm / 10))
+            self._last_adjust = now
+
+
+# Sized for Tier-1 by default; override with GEMINI_RPM for other tiers.
+rate_limiter = AdaptiveRateLimiter(int(os.environ.get("GEMINI_RPM", "300")))
+
+
+def retry_sleep_seconds(error, attempt):
+    """Computes how long to wait after a 429 before retrying.
+
+    Prefers the server's own retry hint when the SDK surfaces one; otherwise
+    uses capped base-2 exponential backoff with jitter (1, 2, 4, ... up to
+    60s) so a transient quota blip never stalls the run for minutes.
+    """
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after:
+        return float(retry_after)
+    retry_delay = getattr(error, 'retry_delay', None)
+    if retry_delay is not None and getattr(retry_delay, 'seconds', 0):
+        return float(retry_delay.seconds)
+    return min(60, 2 ** attempt) + random.uniform(0, 1)
+
+
+async def call_gemini(prompt, response_schema=REVIEW_SCHEMA):
+    """Sends one prompt to Gemini with quota-aware retries and returns the text.
+
+    response_schema constrains the reply to valid JSON of that shape, so the
+    parse-error cell path is effectively unreachable for API output.
+    """
+    generation_config = {
+        "response_mime_type": "application/json",
+        "response_schema": response_schema,
+    }
     max_retries = 5
     for attempt in range(max_retries):
         try:
-            response = genai.GenerativeModel('gemini-2.0-flash').generate_content(prompt)
+            await rate_limiter.acquire()
+            response = await get_model().generate_content_async(
+                prompt, generation_config=generation_config)
             return response.text.strip()
         except ResourceExhausted as e:
+            rate_limiter.on_throttle()
             if attempt < max_retries - 1:
-                sleep_time = 9 ** attempt  # Exponential backoff
-                print(f"Quota exceeded. Retrying in {sleep_time} seconds...")
-                time.sleep(sleep_time)
+                sleep_time = retry_sleep_seconds(e, attempt)
+                logger.warning(f"Quota exceeded. Retrying in {sleep_time:.1f} seconds...")
+                await asyncio.sleep(sleep_time)
             else:
                 raise e
         except Exception as e:
-            print(f"Error during API call: {e}")
+            logger.error(f"Error during API call: {e}")
             return None  # or raise, depending on your desired behavior
 
 
-def get_column_index(sheet, column_name):
-    """Finds the index of the specified column name."""
-    for cell in sheet[1]:
-        if cell.value and cell.value.strip().lower() == column_name.lower():
-            return cell.column
-    return None
-
-
-def process_reviews(xlsx_file_path):
-    """Processes reviews from all sheets in an Excel file and adds sentiment and extractions."""
-    workbook = openpyxl.load_workbook(xlsx_file_path)
-
-    for sheet in workbook.worksheets:
-        sheet_name = sheet.title
-        print(f"Processing sheet: {sheet_name}")
-
-        # Check if columns already exist
-        sentiment_column_index = get_column_index(sheet, 'Sentiment')
-        staff_column_index = get_column_index(sheet, 'Staff Names')
-        dish_column_index = get_column_index(sheet, 'Dish Names')
-        category_column_index = get_column_index(sheet, 'Category')
-
-        reviews_column_index = get_column_index(sheet, 'Reviews')
-        if not reviews_column_index:
-            print(f"Error: 'Reviews' column not found in sheet {sheet_name}. Skipping...")
+async def generate_content_from_file(review):
+    """Generates sentiment and extracts information from a review using Generative AI model."""
+    return await call_gemini(build_prompt(review))
+
+
+async def generate_group_content(semaphore, group):
+    """Analyzes one packed group of reviews with a single API call.
+
+    Returns {row_num: per-review JSON text}.  Reviews missing from the
+    batched reply (or the whole group, on a parse failure) fall back to
+    single-review prompts.
+    """
+    reviews = [str(review) for _, review in group]
+    async with semaphore:
+        api_response = await call_gemini(build_batch_prompt(reviews), BATCH_SCHEMA)
+
+    parsed = parse_group_response(api_response, len(group))
+
+    results = {}
+    for i, (row_num, review) in enumerate(group, start=1):
+        text = parsed.get(i)
+        if text:
+            cache.set(cache_key(review), text, expire=CACHE_EXPIRE_SECONDS)
+            results[row_num] = text
+
+    for row_num, review in group:
+        if row_num not in results:
+            results[row_num] = await generate_content_bounded(semaphore, review)
+    return results
+
+
+async def generate_content_bounded(semaphore, review):
+    """Runs generate_content_from_file under the shared concurrency semaphore.
+
+    Cache hits return immediately without entering the semaphore, so they
+    never take a concurrency slot away from real API calls.
+    """
+    key = cache_key(review)
+    if key in cache:
+        return cache[key]
+
+    async with semaphore:
+        result = await generate_content_from_file(review)
+    if result:
+        cache.set(key, result, expire=CACHE_EXPIRE_SECONDS)
+    return result
+
+
+def load_sheets(xlsx_file_path):
+    """Loads every sheet into a DataFrame, keyed by sheet name.
+
+    Also returns each sheet's original header row: pandas mangles duplicate
+    column names to 'Name.1' on read, and the originals are needed to write
+    the file back with its headers unchanged.
+    """
+    dfs = pd.read_excel(xlsx_file_path, sheet_name=None)
+    raw = pd.read_excel(xlsx_file_path, sheet_name=None, header=None, nrows=1)
+    headers = {name: sheet.iloc[0].tolist() if len(sheet) else []
+               for name, sheet in raw.items()}
+    return dfs, headers
+
+
+def resolve_columns(df):
+    """Locates the Reviews column and the output columns in a DataFrame.
+
+    Returns (reviews_idx, output_positions) with 0-based positions, adding
+    any missing output columns.  reviews_idx is None when the sheet has no
+    Reviews column; the DataFrame is then left untouched.
+    """
+    # One pass over the header instead of re-scanning it per column name.
+    header_map = {str(name).strip().lower(): i for i, name in enumerate(df.columns)}
+
+    reviews_idx = header_map.get('reviews')
+    if reviews_idx is None:
+        return None, None
+
+    output_positions = {}
+    for key, column_name in OUTPUT_COLUMNS.items():
+        idx = header_map.get(column_name.lower())
+        if idx is None:
+            df[column_name] = None
+            idx = len(df.columns) - 1
+        # Pre-existing all-blank columns come back as float64, and writing
+        # strings into those raises on recent pandas; force object dtype.
+        df.isetitem(idx, df.iloc[:, idx].astype(object))
+        output_positions[key] = idx
+    return reviews_idx, output_positions
+
+
+# Heuristic answer for reviews too short to carry any signal; saves the
+# round-trip and token cost Gemini would otherwise charge for them.
+TRIVIAL_RESPONSE = json.dumps(
+    {"sentiment": "neutral", "staff_names": [], "dish_names": [], "category": None})
+
+
+def collect_review_rows(df, reviews_idx):
+    """Collects review rows and pre-answers the ones not worth an API call.
+
+    Returns (items, local_results): items are (row_num, review) tuples for
+    every row with review text, and local_results maps the rows whose text
+    is under 3 characters or has no letters at all to TRIVIAL_RESPONSE.
+    row_num matches the spreadsheet row (header is row 1, data starts at 2).
+    """
+    items = []
+    local_results = {}
+    for idx, review in enumerate(df.iloc[:, reviews_idx]):
+        review_str = str(review).strip() if pd.notna(review) else ''
+        if not review_str:
+            logger.info("No review text found. Skipping...")
             continue
 
-        # Add columns if they don't exist
-        next_available_column = sheet.max_column + 1
-
-        if not sentiment_column_index:
-            sheet.cell(row=1, column=next_available_column, value='Sentiment')
-            sentiment_column_index = next_available_column
-            next_available_column += 1
-
-        if not staff_column_index:
-            sheet.cell(row=1, column=next_available_column, value='Staff Names')
-            staff_column_index = next_available_column
-            next_available_column += 1
-
-        if not dish_column_index:
-            sheet.cell(row=1, column=next_available_column, value='Dish Names')
-            dish_column_index = next_available_column
-            next_available_column += 1
+        row_num = idx + 2
+        items.append((row_num, review))
+        if len(review_str) < 3 or not any(c.isalpha() for c in review_str):
+            logger.info(f"Review too short to analyze; defaulting to Neutral: {review_str!r}")
+            local_results[row_num] = TRIVIAL_RESPONSE
+    return items, local_results
+
+
+def parse_api_response(sheet_name, row_num, review, api_response):
+    """Parses one API response into {'sentiment', 'staff', 'dish', 'category'} values.
+
+    An error marker fills all four values when the response is missing or
+    unparseable, matching what the old in-place cell writer produced.
+    """
+    try:
+        if isinstance(api_response, Exception):
+            raise api_response
+
+        if api_response:
+            logger.debug(f"API Response: {api_response}")
+
+            try:
+                data = extract_json(api_response)
+                sentiment = SENT_MAP.get(str(data.get('sentiment', '')).strip().lower(), 'Neutral')
+                staff_names = data.get('staff_names', [])
+                dish_names = data.get('dish_names', [])
+                category = data.get('category', 'Unknown')
+
+                logger.info(f"Review: {review}\nSentiment: {sentiment}\nStaff: {staff_names}\nDishes: {dish_names}\nCategory: {category}")
+
+                return {
+                    'sentiment': sentiment,
+                    'staff': ', '.join(staff_names) if isinstance(staff_names, list) else str(staff_names), #Handle if staff_names is not a list.
+                    'dish': ', '.join(dish_names) if isinstance(dish_names, list) else str(dish_names), #Handle if dish_names is not a list.
+                    'category': category,
+                }
+
+            except orjson.JSONDecodeError as e:
+                logger.error(f"Error decoding JSON response in sheet {sheet_name} row {row_num}: {e}\nResponse was: {api_response}")
+                with open("json_error_log.txt", "a") as f: #Log response to a file
+                    f.write(f"Sheet: {sheet_name}, Row: {row_num}\n")
+                    f.write(f"Response: {api_response}\n")
+                    f.write(traceback.format_exc() + "\n")
+
+                return dict.fromkeys(OUTPUT_COLUMNS, "JSON Error")
+            except UnicodeDecodeError as e:
+                logger.error(f"UnicodeDecodeError: {e}")
+                # Handle the encoding error appropriately (e.g., try a different encoding)
+                return dict.fromkeys(OUTPUT_COLUMNS, "Encoding Error")
+
+        else:
+            logger.error(f"No response from API for review in sheet {sheet_name} row {row_num}")
+            return dict.fromkeys(OUTPUT_COLUMNS, "API Error")
+
+    except Exception as e:
+        logger.error(f"Error processing review in sheet {sheet_name} row {row_num}: {e}")
+        return dict.fromkeys(OUTPUT_COLUMNS, "Error")
+
+
+def apply_responses(sheet_name, df, items, responses, output_positions):
+    """Parses each response and writes the values into the DataFrame."""
+    for row_num, review in items:
+        values = parse_api_response(sheet_name, row_num, review, responses.get(row_num))
+        for key, idx in output_positions.items():
+            df.iat[row_num - 2, idx] = values[key]
+
+
+def load_checkpoint(ckpt_file_path):
+    """Loads {(sheet, row): response_text} completed by an interrupted run."""
+    done = {}
+    if os.path.exists(ckpt_file_path):
+        with open(ckpt_file_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a partial line from a crash mid-write
+                done[(record["sheet"], record["row"])] = record.get("result")
+    if done:
+        logger.info(f"Resuming from checkpoint: {len(done)} rows already completed")
+    return done
+
+
+def write_sheets(xlsx_file_path, dfs, headers):
+    """Writes the enriched DataFrames back over their sheets in place.
+
+    Restores each sheet's original header row so duplicate column names
+    pandas mangled on read ('Sentiment.1') don't leak into the file; columns
+    appended by this run keep their DataFrame names.
+    """
+    with pd.ExcelWriter(xlsx_file_path, engine='openpyxl', mode='a',
+                        if_sheet_exists='overlay') as writer:
+        for sheet_name, df in dfs.items():
+            original = headers.get(sheet_name, [])
+            restored = [orig if pd.notna(orig) else current
+                        for orig, current in zip(original, df.columns)]
+            out = df.copy(deep=False)
+            out.columns = restored + list(df.columns[len(restored):])
+            out.to_excel(writer, sheet_name=sheet_name, index=False)
+
+
+async def process_sheet_async(sheet_name, df, semaphore, done, ckpt):
+    """Runs the full pipeline for one sheet: column scan, cache/checkpoint
+    triage, gathered API calls, and writing results into the DataFrame.
+
+    Failures are contained here: under a TaskGroup an escaping exception
+    would cancel every other sheet and skip the final save, so one bad sheet
+    must only cost its own rows.
+    """
+    try:
+        await _process_sheet(sheet_name, df, semaphore, done, ckpt)
+    except Exception:
+        logger.error(f"Sheet {sheet_name} failed; its rows are left unwritten.\n"
+                     f"{traceback.format_exc()}")
+
+
+async def _process_sheet(sheet_name, df, semaphore, done, ckpt):
+    logger.info(f"Processing sheet: {sheet_name}")
+
+    reviews_idx, output_positions = resolve_columns(df)
+    if reviews_idx is None:
+        logger.error(f"Error: 'Reviews' column not found in sheet {sheet_name}. Skipping...")
+        return
 
-        if not category_column_index:
-            sheet.cell(row=1, column=next_available_column, value='Category')
-            category_column_index = next_available_column
-            next_available_column += 1
+    items, local_results = collect_review_rows(df, reviews_idx)
 
-        for row_num, row in enumerate(sheet.iter_rows(min_row=2, values_only=True), start=2):
-            review = row[reviews_column_index - 1] if len(row) >= reviews_column_index else None
+    # Serve heuristic answers, checkpointed rows and cache hits up front;
+    # duplicate review texts collapse to a single API call, so only
+    # unique misses get packed into prompts.
+    responses = dict(local_results)
+    pending = {}
+    for row_num, review in items:
+        if row_num in responses:
+            continue
+        if (sheet_name, row_num) in done:
+            responses[row_num] = done[(sheet_name, row_num)]
+            continue
+        key = cache_key(review)
+        if key in cache:
+            responses[row_num] = cache[key]
+        else:
+            pending.setdefault(str(review).strip().lower(), []).append((row_num, review))
+
+    unique_misses = [dup_rows[0] for dup_rows in pending.values()]
+    groups = pack_review_groups(unique_misses)
+    group_results = await asyncio.gather(
+        *(generate_group_content(semaphore, group) for group in groups),
+        return_exceptions=True
+    )
+    for group, result in zip(groups, group_results):
+        if isinstance(result, Exception):
+            for row_num, _ in group:
+                responses[row_num] = result
+        else:
+            responses.update(result)
+
+    # Fan each unique result back out to the duplicate rows.
+    for dup_rows in pending.values():
+        result = responses.get(dup_rows[0][0])
+        for row_num, _ in dup_rows[1:]:
+            responses[row_num] = result
+
+    # Record newly completed rows before moving on.
+    for row_num, review in items:
+        result = responses.get(row_num)
+        if (sheet_name, row_num) not in done and isinstance(result, str):
+            ckpt.write(json.dumps({"sheet": sheet_name, "row": row_num, "result": result}) + "\n")
+            ckpt.flush()
+
+    apply_responses(sheet_name, df, items, responses, output_positions)
+
+
+async def process_reviews_async(xlsx_file_path):
+    """Processes reviews from all sheets in an Excel file and adds sentiment and extractions."""
+    dfs, headers = load_sheets(xlsx_file_path)
+
+    # Concurrent Gemini calls; sized to stay inside the tier RPM budget.
+    semaphore = asyncio.Semaphore(int(os.environ.get("GEMINI_CONCURRENCY", "15")))
+
+    # Each completed row is appended to a JSONL sidecar so a crash (API
+    # outage, SIGINT) doesn't throw away finished API work; the sidecar is
+    # deleted once the workbook saves cleanly.
+    ckpt_file_path = xlsx_file_path + ".ckpt.jsonl"
+    done = load_checkpoint(ckpt_file_path)
+    ckpt = open(ckpt_file_path, "a")
+
+    # Sheets are independent, so they run as concurrent tasks; the shared
+    # semaphore and rate limiter keep the total request rate bounded.
+    async with asyncio.TaskGroup() as tg:
+        for sheet_name, df in dfs.items():
+            tg.create_task(process_sheet_async(sheet_name, df, semaphore, done, ckpt))
+
+    ckpt.close()
+    write_sheets(xlsx_file_path, dfs, headers)
+    if os.path.exists(ckpt_file_path):
+        os.remove(ckpt_file_path)
+    logger.info(f"Sentiment analysis and extraction completed. Updated file: {xlsx_file_path}")
+
+
+def build_batch_requests(items):
+    """Builds the inline request list for one sheet's batch job.
+
+    Replies come back in the same order as the requests, so rows are mapped
+    back by position.
+    """
+    return [{
+        "contents": [{"parts": [{"text": build_prompt(review)}], "role": "user"}],
+        "config": {
+            "response_mime_type": "application/json",
+            "response_schema": REVIEW_SCHEMA,
+        },
+    } for _, review in items]
+
+
+def load_batch_state():
+    """Loads pending batch job ids from the local state file (crash recovery)."""
+    if os.path.exists(BATCH_STATE_FILE):
+        with open(BATCH_STATE_FILE) as f:
+            return json.load(f)
+    return {}
+
+
+def save_batch_state(state):
+    """Persists pending batch job ids so an interrupted run can resume polling."""
+    with open(BATCH_STATE_FILE, "w") as f:
+        json.dump(state, f)
+
+
+def wait_for_batch(client, batch_name):
+    """Polls a batch job until it reaches a terminal state and returns it."""
+    terminal_states = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED",
+                       "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
+    while True:
+        job = client.batches.get(name=batch_name)
+        state = getattr(job.state, "name", str(job.state))
+        if state in terminal_states:
+            return job
+        logger.info(f"Batch {batch_name} still {state}. Checking again in {BATCH_POLL_SECONDS}s...")
+        time.sleep(BATCH_POLL_SECONDS)
+
+
+def extract_batch_responses(job, expected_count):
+    """Pulls the per-request reply texts out of a finished inline batch job.
+
+    Returns a list aligned with the submitted requests, padded with None for
+    anything missing or errored.
+    """
+    inlined = getattr(getattr(job, "dest", None), "inlined_responses", None) or []
+    texts = []
+    for item in inlined:
+        response = getattr(item, "response", None)
+        text = getattr(response, "text", None) if response else None
+        texts.append(text.strip() if text else None)
+    texts.extend([None] * (expected_count - len(texts)))
+    return texts
+
+
+def process_reviews_batch(xlsx_file_path, api_key):
+    """Processes reviews via the Gemini Batch API: one inline job per sheet.
+
+    Avoids per-request HTTP overhead and the interactive RPM ceiling; suited to
+    non-interactive spreadsheet enrichment.  Pending job ids are persisted to
+    BATCH_STATE_FILE so a crashed run resumes polling instead of resubmitting.
+    Batch jobs live in the google-genai SDK, not google-generativeai, so that
+    package is an extra requirement of --batch.
+    """
+    if genai_sdk is None:
+        logger.warning("--batch requires the google-genai package (pip install google-genai). "
+                       "Falling back to the standard concurrent path.")
+        asyncio.run(process_reviews_async(xlsx_file_path))
+        return
 
-            if review:
-                try:
-                    api_response = generate_content_from_file(review)
-
-                    if api_response:
-                        print(f"API Response: {api_response}")  # Add this line for debugging
-
-                        # Remove the extra characters before and after the JSON
-                        api_response = api_response.replace("```json", "").replace("```", "").strip()
-
-                        try:
-                            #api_response = api_response.encode('utf-8').decode('utf-8') #Try to fix decoding errors
-                            data = json.loads(api_response)
-                            sentiment = data.get('sentiment', 'Unknown')
-                            staff_names = data.get('staff_names', [])
-                            dish_names = data.get('dish_names', [])
-                            category = data.get('category', 'Unknown')
-
-                            sheet.cell(row=row_num, column=sentiment_column_index, value=sentiment)
-                            sheet.cell(row=row_num, column=staff_column_index, value=', '.join(staff_names) if isinstance(staff_names, list) else str(staff_names)) #Handle if staff_names is not a list.
-                            sheet.cell(row=row_num, column=dish_column_index, value=', '.join(dish_names) if isinstance(dish_names, list) else str(dish_names)) #Handle if dish_names is not a list.
-                            sheet.cell(row=row_num, column=category_column_index, value=category)
-
-                            print(f"Review: {review}\nSentiment: {sentiment}\nStaff: {staff_names}\nDishes: {dish_names}\nCategory: {category}\n")
-
-                        except json.JSONDecodeError as e:
-                            print(f"Error decoding JSON response in sheet {sheet_name} row {row_num}: {e}\nResponse was: {api_response}")
-                            traceback.print_exc() #Print the traceback
-                            with open("json_error_log.txt", "a") as f: #Log response to a file
-                                f.write(f"Sheet: {sheet_name}, Row: {row_num}\n")
-                                f.write(f"Response: {api_response}\n")
-                                f.write(traceback.format_exc() + "\n")
-
-                            sheet.cell(row=row_num, column=sentiment_column_index, value="JSON Error")
-                            sheet.cell(row=row_num, column=staff_column_index, value="JSON Error")
-                            sheet.cell(row=row_num, column=dish_column_index, value="JSON Error")
-                            sheet.cell(row=row_num, column=category_column_index, value="JSON Error")
-                        except UnicodeDecodeError as e:
-                            print(f"UnicodeDecodeError: {e}")
-                            # Handle the encoding error appropriately (e.g., try a different encoding)
-                            sheet.cell(row=row_num, column=sentiment_column_index, value="Encoding Error")
-                            sheet.cell(row=row_num, column=staff_column_index, value="Encoding Error")
-                            sheet.cell(row=row_num, column=dish_column_index, value="Encoding Error")
-                            sheet.cell(row=row_num, column=category_column_index, value="Encoding Error")
-
-
-                    else:
-                        print(f"No response from API for review in sheet {sheet_name} row {row_num}")
-                        sheet.cell(row=row_num, column=sentiment_column_index, value="API Error")
-                        sheet.cell(row=row_num, column=staff_column_index, value="API Error")
-                        sheet.cell(row=row_num, column=dish_column_index, value="API Error")
-                        sheet.cell(row=row_num, column=category_column_index, value="API Error")
-
-
-                except Exception as e:
-                    print(f"Error processing review in sheet {sheet_name} row {row_num}: {e}")
-                    sheet.cell(row=row_num, column=sentiment_column_index, value="Error")
-                    sheet.cell(row=row_num, column=staff_column_index, value="Error")
-                    sheet.cell(row=row_num, column=dish_column_index, value="Error")
-                    sheet.cell(row=row_num, column=category_column_index, value="Error")
+    client = genai_sdk.Client(api_key=api_key)
+    dfs, headers = load_sheets(xlsx_file_path)
+    state = load_batch_state()
 
-            else:
-                print("No review text found. Skipping...\n")
-                continue
+    for sheet_name, df in dfs.items():
+        logger.info(f"Processing sheet: {sheet_name}")
 
-    workbook.save(xlsx_file_path)
-    print(f"Sentiment analysis and extraction completed. Updated file: {xlsx_file_path}")
+        reviews_idx, output_positions = resolve_columns(df)
+        if reviews_idx is None:
+            logger.error(f"Error: 'Reviews' column not found in sheet {sheet_name}. Skipping...")
+            continue
 
+        items, local_results = collect_review_rows(df, reviews_idx)
+        api_items = [(row_num, review) for row_num, review in items
+                     if row_num not in local_results]
+        responses = dict(local_results)
+        if not api_items:
+            apply_responses(sheet_name, df, items, responses, output_positions)
+            continue
 
+        batch_name = state.get(sheet_name)
+        if batch_name:
+            logger.info(f"Resuming batch {batch_name} for sheet {sheet_name}")
+        else:
+            job = client.batches.create(model=f"models/{MODEL_NAME}",
+                                        src=build_batch_requests(api_items),
+                                        config={"display_name": sheet_name})
+            batch_name = job.name
+            logger.info(f"Submitted batch {batch_name} for sheet {sheet_name} ({len(api_items)} reviews)")
+            state[sheet_name] = batch_name
+            save_batch_state(state)
+
+        job = wait_for_batch(client, batch_name)
+        texts = extract_batch_responses(job, len(api_items))
+        if any(text is not None for text in texts):
+            for (row_num, review), text in zip(api_items, texts):
+                responses[row_num] = text
+        else:
+            logger.error(f"Batch {batch_name} finished without output for sheet {sheet_name}")
+
+        apply_responses(sheet_name, df, items, responses, output_positions)
+
+        state.pop(sheet_name, None)
+        save_batch_state(state)
+
+    write_sheets(xlsx_file_path, dfs, headers)
+    if os.path.exists(BATCH_STATE_FILE) and not load_batch_state():
+        os.remove(BATCH_STATE_FILE)
+    logger.info(f"Sentiment analysis and extraction completed. Updated file: {xlsx_file_path}")
 
 
 def main():
     """Main function to execute the sentiment analysis."""
-    api_key = os.environ.get("GEMINI_API_KEY")
-
-    if not api_key:
-        print("Error: GEMINI_API_KEY environment variable not set.")
-        return
-
-    genai.configure(api_key=api_key)
-
-    xlsx_file_path = "A2b_January_month.xlsx"
-    process_reviews(xlsx_file_path)
+    listener = setup_logging(quiet="--quiet" in sys.argv[1:])
+    try:
+        api_key = os.environ.get("GEMINI_API_KEY")
+
+        if not api_key:
+            logger.error("Error: GEMINI_API_KEY environment variable not set.")
+            return
+
+        # One persistent async gRPC channel multiplexes every request; without
+        # an explicit transport each call can pay its own TLS handshake.
+        # Combined with the singleton model, all reviews share one connection.
+        genai.configure(api_key=api_key, transport="grpc_asyncio")
+
+        xlsx_file_path = "A2b_January_month.xlsx"
+        if "--batch" in sys.argv[1:]:
+            process_reviews_batch(xlsx_file_path, api_key)
+        else:
+            asyncio.run(process_reviews_async(xlsx_file_path))
+    finally:
+        listener.stop()
 
 
 if __name__ == "__main__":